@@ -12,7 +12,7 @@ Features:
 - Payments: supports storing payment proof photos (admin approval)
 - Admin panel to approve subscription/payments/orders
 - Background cleanup task: deletes old photo files and clears references
-- Export orders to Excel (requires pandas + openpyxl)
+- Export orders to Excel (requires openpyxl) or CSV (/export_orders csv)
 
 Folder layout expected:
 bot-root/
@@ -23,15 +23,28 @@ bot-root/
 
 Usage:
 - populate .env with BOT_TOKEN and ADMIN_ID
+- optional: LOG_LEVEL (default WARNING)
+- optional: PHOTOS_DIR (default photos/) to keep archived photos on another filesystem
+- optional: set WEBHOOK_URL (public https base URL) to receive updates by webhook
+  instead of long polling; WEBHOOK_LISTEN / WEBHOOK_PORT control the local listener
 - pip install -r requirements.txt
 - python marketlink_pro.py
 """
 
 import os
+import io
+import re
+import csv
+import sys
 import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import Optional, List
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from itertools import count
+from datetime import date, datetime, timedelta
+from typing import Optional, List, Tuple, Iterable, Callable, Awaitable
 
 import aiosqlite
 from dotenv import load_dotenv
@@ -42,6 +55,7 @@ from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
 )
+from telegram.constants import MessageLimit
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -50,6 +64,11 @@ from telegram.ext import (
     ContextTypes,
     ConversationHandler,
     CallbackQueryHandler,
+    Defaults,
+    TypeHandler,
+    PicklePersistence,
+    PersistenceInput,
+    AIORateLimiter,
 )
 
 # ---------------- CONFIG ----------------
@@ -60,14 +79,42 @@ try:
 except Exception:
     ADMIN_ID = 0
 
+# webhook mode (production): Telegram pushes updates to WEBHOOK_URL/<token>;
+# unset -> long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+try:
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+except Exception:
+    WEBHOOK_PORT = 8443
+
 DATA_DIR = "data"
 DB_PATH = os.path.join(DATA_DIR, "shop.db")
-PHOTOS_DIR = "photos"
+CONV_STATE_PATH = os.path.join(DATA_DIR, "conv_state.pkl")  # conversation state across restarts
+# rows store the full path, so PHOTOS_DIR can move (e.g. to a tmpfs or a faster disk)
+# without breaking references to photos archived before the change
+PHOTOS_DIR = os.getenv("PHOTOS_DIR", "photos")
 PHOTO_RETENTION_DAYS = 30  # background cleanup: remove photos older than this
+PHOTO_CLEANUP_INTERVAL = 24 * 3600  # seconds between photo cleanup runs
+PHOTO_PURGE_CHUNK = 1000  # files unlinked per worker-thread call during cleanup
+
+PERSISTENCE_FLUSH_INTERVAL = 60  # seconds between writes of the conversation-state pickle
+CONVERSATION_TIMEOUT = timedelta(minutes=10)  # idle conversations are dropped after this
 
 TRIAL_DAYS = 3
 SUBSCRIPTION_EXTEND_DAYS = 30
 SUBSCRIPTION_FEE = 5000  # MMK (informational)
+SEND_RATE = 25  # max outgoing Bot API calls per second (AIORateLimiter), under Telegram's 30/s
+SEND_RETRIES = 3  # times the rate limiter retries a send after Telegram answers RetryAfter
+SHOP_CACHE_SIZE = 4096  # max owners kept in the in-process shop cache
+CURRENT_SHOP_SIZE = 100_000  # customers whose deep-link shop selection is remembered (LRU)
+SHOP_CACHE_TTL = 60  # seconds; bounds staleness if shops are edited outside the bot
+SHOPS_PAGE_SIZE = 20  # shops per page in the admin "All Shops" listing
+SHOP_NAME_LISTED = 120  # UTF-16 units of a shop name shown per "All Shops" line
+STATS_TTL = 10  # seconds the admin "Platform Stats" counts are reused
+SHOPS_PAGE_TTL = 30  # seconds a rendered "All Shops" page is reused (safety net; writes invalidate)
+MESSAGE_CHUNK = 4000  # max UTF-16 units per listing reply; Telegram rejects texts over 4096
+WRITE_BATCH_WINDOW = 0.02  # seconds the group-commit writer waits to gather a batch
 
 # Conversation states
 (
@@ -80,255 +127,704 @@ SUBSCRIPTION_FEE = 5000  # MMK (informational)
 (EDIT_PROD_ID, EDIT_PROD_NAME, EDIT_PROD_PRICE) = range(7, 10)
 (PAYMENT_WAIT,) = range(10, 11)
 
+# Reply-keyboard labels: the keyboards in start() and the filters.Text routes in main()
+# share these constants so a label can't drift between the two.
+MENU_PLATFORM_STATS = sys.intern("📊 Platform Stats")
+MENU_PENDING = sys.intern("📥 Pending Payments")
+MENU_ALL_SHOPS = sys.intern("🏬 All Shops")
+MENU_BROADCAST = sys.intern("📤 Broadcast")
+MENU_ADD_PRODUCT = sys.intern("➕ Add Product")
+MENU_MY_ORDERS = sys.intern("🛒 My Orders")
+MENU_MY_LINK = sys.intern("🔗 My Link")
+MENU_SUBSCRIPTION = sys.intern("💳 Subscription")
+MENU_CREATE_SHOP = sys.intern("📝 Create Shop (/setup_shop MyShopName)")
+MENU_HELP = sys.intern("ℹ️ Help")
+
+# /start keyboards never change, so they are built once (PTB markups are immutable)
+ADMIN_KB = ReplyKeyboardMarkup([[MENU_PLATFORM_STATS, MENU_PENDING], [MENU_ALL_SHOPS, MENU_BROADCAST]], resize_keyboard=True)
+OWNER_KB = ReplyKeyboardMarkup([[MENU_ADD_PRODUCT, MENU_MY_ORDERS], [MENU_MY_LINK, MENU_SUBSCRIPTION]], resize_keyboard=True)
+NEW_KB = ReplyKeyboardMarkup([[MENU_CREATE_SHOP, MENU_HELP]], resize_keyboard=True)
+
+# plain text that isn't a /command; built once and shared by every handler that needs it
+TEXT_NONCMD = filters.TEXT & ~filters.COMMAND
+
+
+@dataclass(slots=True)
+class OrderCtx:
+    """Per-customer state of the /order conversation, kept in user_data["_order"]."""
+
+    shop_id: int = 0
+    cart: List[str] = field(default_factory=list)  # optional textual items
+    total: int = 0
+    name: str = ""
+    phone: str = ""
+    address: str = ""
+
+
 # Ensure folders exist
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(PHOTOS_DIR, exist_ok=True)
 
 # ---------------- LOG ----------------
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+# WARNING by default so busy bots don't pay for formatting/writing every INFO line;
+# set LOG_LEVEL=INFO (or DEBUG) in .env when diagnosing
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+logging.basicConfig(level=getattr(logging, LOG_LEVEL, logging.WARNING), format="%(asctime)s [%(levelname)s] %(message)s")
+# httpx logs every Bot API request at INFO; keep it quiet even when LOG_LEVEL=INFO
+logging.getLogger("httpx").setLevel(logging.WARNING)
 log = logging.getLogger("marketlink_pro")
 
 # ---------------- DB HELPERS (async) ----------------
+# One writer connection is opened by init_db() and shared by every write helper
+# for the whole process lifetime, so SQLite keeps its page cache warm between updates.
+# Autocommit mode (isolation_level=None): single statements commit themselves.
+_DB: Optional[aiosqlite.Connection] = None
+# Held by writers so that single-statement writes never interleave with an
+# explicit BEGIN ... COMMIT issued by another handler on the shared connection.
+_DB_WRITE_LOCK = asyncio.Lock()
+# SELECTs borrow one of DB_READERS read-only connections (each with its own worker
+# thread); under WAL they run alongside the writer and never queue behind it.
+DB_READERS = 4
+_READER_POOL: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+_READER_CONNS: List[aiosqlite.Connection] = []
+
+# page_size and auto_vacuum only take effect on a fresh DB and must precede the switch
+# to WAL; init_db converts older files to incremental auto-vacuum once (SCHEMA_VERSION 2).
+# mmap_size stays at 64 MB so low-memory (Termux/Android) hosts are not pushed into OOM.
+DB_PRAGMAS = """
+PRAGMA page_size = 4096;
+PRAGMA auto_vacuum = INCREMENTAL;
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -64000;
+PRAGMA mmap_size = 67108864;
+PRAGMA foreign_keys = ON;
+PRAGMA wal_autocheckpoint = 1000;
+"""
+# journal_mode is persistent in the file, so readers only need their cache settings
+DB_RO_PRAGMAS = """
+PRAGMA query_only = ON;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -64000;
+PRAGMA mmap_size = 67108864;
+"""
+# bump SCHEMA_VERSION whenever DB_SCHEMA or the upgrade steps in init_db change,
+# otherwise existing databases (PRAGMA user_version) will not pick the change up.
+# 2: existing files converted to auto_vacuum = INCREMENTAL
+SCHEMA_VERSION = 2
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shops (
+    owner_id INTEGER PRIMARY KEY,
+    shop_name TEXT,
+    expire_date TEXT,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner_id INTEGER,
+    name TEXT,
+    price INTEGER,
+    FOREIGN KEY(owner_id) REFERENCES shops(owner_id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS links (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner_id INTEGER,
+    title TEXT,
+    url TEXT,
+    FOREIGN KEY(owner_id) REFERENCES shops(owner_id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    shop_id INTEGER,
+    user_id INTEGER,
+    name TEXT,
+    phone TEXT,
+    address TEXT,
+    items TEXT,
+    total INTEGER,
+    photo_path TEXT,
+    photo_file_id TEXT,
+    status TEXT,
+    created_at TEXT,
+    FOREIGN KEY(shop_id) REFERENCES shops(owner_id) ON DELETE SET NULL
+);
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid INTEGER,
+    kind TEXT,
+    ref_id INTEGER,
+    photo_path TEXT,
+    photo_file_id TEXT,
+    status TEXT,
+    created_at TEXT
+);
+-- covering (rowid id is implicit), so per-owner lists never touch the table
+DROP INDEX IF EXISTS idx_products_owner;
+DROP INDEX IF EXISTS idx_links_owner;
+CREATE INDEX IF NOT EXISTS idx_products_owner_cov ON products(owner_id, name, price);
+CREATE INDEX IF NOT EXISTS idx_links_owner_cov ON links(owner_id, title, url);
+CREATE INDEX IF NOT EXISTS idx_orders_shop ON orders(shop_id, id DESC);
+-- only pending payments are ever looked up by status; a partial index stays
+-- as small as the approval queue instead of growing with payment history
+DROP INDEX IF EXISTS idx_payments_status;
+CREATE INDEX IF NOT EXISTS idx_payments_pending ON payments(id) WHERE status = 'pending';
+-- retention cleanup: range seek on age over rows that still reference a file
+CREATE INDEX IF NOT EXISTS idx_orders_photo_age ON orders(created_at) WHERE photo_path IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_payments_photo_age ON payments(created_at) WHERE photo_path IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_shops_expire ON shops(expire_date);
+"""
+DB_OPTIMIZE_INTERVAL = 30 * 60  # seconds between PRAGMA optimize + WAL checkpoint runs
+DB_VACUUM_PAGES = 1000  # free pages released per photo cleanup run (auto_vacuum=INCREMENTAL)
+DB_STATEMENT_CACHE = 256  # prepared statements kept per connection (sqlite3 default: 128)
+
+# SQL is kept in module-level constants so every call passes the identical string
+# and hits sqlite3's per-connection prepared-statement cache (see DB_STATEMENT_CACHE).
+_SQL_GET_SHOP = "SELECT owner_id, shop_name, expire_date, created_at FROM shops WHERE owner_id = ?"
+# UPSERT, not INSERT OR REPLACE: REPLACE deletes the old row first, which fires the
+# ON DELETE CASCADE on products/links and orphans the shop's orders
+_SQL_SET_SHOP = (
+    "INSERT INTO shops(owner_id, shop_name, expire_date, created_at) VALUES(?,?,?,date('now')) "
+    "ON CONFLICT(owner_id) DO UPDATE SET shop_name = excluded.shop_name, expire_date = excluded.expire_date"
+)
+_SQL_LIST_SHOPS_PAGE = "SELECT owner_id, shop_name, expire_date FROM shops ORDER BY expire_date, owner_id LIMIT ? OFFSET ?"
+_SQL_LIST_SHOP_OWNERS = "SELECT owner_id FROM shops"
+# date() yields NULL for a missing/garbled expiry, so those extend from today
+_SQL_EXTEND_SHOP = (
+    "UPDATE shops SET expire_date = date(COALESCE(date(expire_date), date('now')), '+' || ? || ' days') "
+    "WHERE owner_id = ? RETURNING expire_date"
+)
+_SQL_ADD_PRODUCT = "INSERT INTO products(owner_id, name, price) VALUES(?,?,?)"
+_SQL_LIST_PRODUCTS = "SELECT id, name, price FROM products WHERE owner_id = ?"
+_SQL_GET_OWNED_PRODUCT = "SELECT id, name, price FROM products WHERE id = ? AND owner_id = ?"
+_SQL_GET_PRODUCT = "SELECT id, name, price FROM products WHERE id = ?"
+_SQL_UPDATE_PRODUCT = "UPDATE products SET name = ?, price = ? WHERE id = ? AND owner_id = ?"
+_SQL_DELETE_PRODUCT = "DELETE FROM products WHERE id = ? AND owner_id = ?"
+_SQL_ADD_LINK = "INSERT INTO links(owner_id, title, url) VALUES(?,?,?)"
+_SQL_LIST_LINKS = "SELECT id, title, url FROM links WHERE owner_id = ?"
+_SQL_GET_LINK = "SELECT id, title, url FROM links WHERE id = ? AND owner_id = ?"
+_SQL_UPDATE_LINK = "UPDATE links SET title = ?, url = ? WHERE id = ? AND owner_id = ?"
+# created_at timestamps are produced by SQLite (UTC) rather than formatted in Python
+_SQL_NOW = "strftime('%Y-%m-%d %H:%M:%S', 'now')"
+_SQL_INSERT_ORDER = f"INSERT INTO orders(shop_id, user_id, name, phone, address, items, total, photo_path, photo_file_id, status, created_at) VALUES(?,?,?,?,?,?,?,?,?,?,{_SQL_NOW})"
+_SQL_GET_ORDER = "SELECT id, shop_id, user_id, status FROM orders WHERE id = ?"
+_SQL_SET_ORDER_STATUS = "UPDATE orders SET status = ? WHERE id = ?"
+_SQL_LIST_ORDERS_BY_SHOP = "SELECT id, user_id, name, phone, address, items, total, status, created_at FROM orders WHERE shop_id = ? ORDER BY id DESC"
+_SQL_INSERT_PAYMENT = f"INSERT INTO payments(uid, kind, ref_id, photo_path, photo_file_id, status, created_at) VALUES(?,?,?,?,?,?,{_SQL_NOW})"
+_SQL_PENDING_PAYMENTS = (
+    "SELECT p.id, p.uid, p.kind, p.ref_id, p.photo_path, p.photo_file_id, p.status, p.created_at, o.total, o.name "
+    "FROM payments p LEFT JOIN orders o ON p.kind = 'order' AND o.id = p.ref_id "
+    "WHERE p.status = 'pending' ORDER BY p.id ASC"
+)
+_SQL_SET_PAYMENT_STATUS = "UPDATE payments SET status = ? WHERE id = ?"
+# created_at is UTC "YYYY-MM-DD HH:MM:SS", so comparing it as text orders correctly
+_SQL_PAYMENT_PHOTOS = "SELECT id, photo_path FROM payments WHERE photo_path IS NOT NULL AND created_at < ?"
+_SQL_ORDER_PHOTOS = "SELECT id, photo_path FROM orders WHERE photo_path IS NOT NULL AND created_at < ?"
+_SQL_CLEAR_PAYMENT_PHOTO = "UPDATE payments SET photo_path = NULL WHERE id = ?"
+_SQL_CLEAR_ORDER_PHOTO = "UPDATE orders SET photo_path = NULL WHERE id = ?"
+_SQL_PLATFORM_STATS = (
+    "SELECT (SELECT COUNT(*) FROM shops), (SELECT COUNT(*) FROM orders), "
+    "(SELECT COUNT(*) FROM payments WHERE status = 'pending')"
+)
+
+
+def _db() -> aiosqlite.Connection:
+    if _DB is None:
+        raise RuntimeError("Database is not open. Call init_db() first.")
+    return _DB
+
+
+@asynccontextmanager
+async def reader():
+    """Borrow a read-only connection from the pool for the duration of the block."""
+    if not _READER_CONNS:
+        raise RuntimeError("Database is not open. Call init_db() first.")
+    db = await _READER_POOL.get()
+    try:
+        yield db
+    finally:
+        _READER_POOL.put_nowait(db)
+
+
 async def init_db() -> None:
-    """Create DB and required tables if missing."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.executescript(
-            """
-        PRAGMA foreign_keys = ON;
-        CREATE TABLE IF NOT EXISTS shops (
-            owner_id INTEGER PRIMARY KEY,
-            shop_name TEXT,
-            expire_date TEXT,
-            created_at TEXT
-        );
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            owner_id INTEGER,
-            name TEXT,
-            price INTEGER,
-            FOREIGN KEY(owner_id) REFERENCES shops(owner_id) ON DELETE CASCADE
-        );
-        CREATE TABLE IF NOT EXISTS links (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            owner_id INTEGER,
-            title TEXT,
-            url TEXT,
-            FOREIGN KEY(owner_id) REFERENCES shops(owner_id) ON DELETE CASCADE
-        );
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            shop_id INTEGER,
-            user_id INTEGER,
-            name TEXT,
-            phone TEXT,
-            address TEXT,
-            items TEXT,
-            total INTEGER,
-            photo_path TEXT,
-            status TEXT,
-            created_at TEXT,
-            FOREIGN KEY(shop_id) REFERENCES shops(owner_id) ON DELETE SET NULL
-        );
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            uid INTEGER,
-            kind TEXT,
-            ref_id INTEGER,
-            photo_path TEXT,
-            status TEXT,
-            created_at TEXT
-        );
-        """
-        )
+    """Open the shared DB connection and create required tables if missing."""
+    global _DB
+    if _DB is None:
+        _DB = await aiosqlite.connect(DB_PATH, isolation_level=None, cached_statements=DB_STATEMENT_CACHE)
+        _DB.row_factory = aiosqlite.Row
+        await _DB.executescript(DB_PRAGMAS)
+    async with _DB.execute("PRAGMA user_version") as cur:
+        (version,) = await cur.fetchone()
+    # the bootstrap only runs when the file predates SCHEMA_VERSION; a restart of an
+    # up-to-date DB skips parsing the DDL, the column checks and ANALYZE entirely
+    if version < SCHEMA_VERSION:
+        try:
+            await _DB.executescript("BEGIN IMMEDIATE;" + DB_SCHEMA)
+            # columns added after the first release; CREATE TABLE IF NOT EXISTS skips existing DBs
+            await _ensure_column(_DB, "orders", "photo_file_id", "TEXT")
+            await _ensure_column(_DB, "payments", "photo_file_id", "TEXT")
+            await _DB.commit()
+        except BaseException:
+            if _DB.in_transaction:
+                await _DB.rollback()
+            raise
+        # files created before auto_vacuum was set are converted once; the mode only
+        # changes through a full VACUUM (which cannot run inside a transaction)
+        async with _DB.execute("PRAGMA auto_vacuum") as cur:
+            (auto_vacuum,) = await cur.fetchone()
+        if auto_vacuum == 0:
+            log.warning("Rebuilding %s once to enable incremental auto-vacuum", DB_PATH)
+            await _DB.executescript("PRAGMA auto_vacuum = INCREMENTAL; VACUUM;")
+        # planner statistics for the new indexes; analysis_limit keeps this quick on big DBs.
+        # later drift is handled by the periodic PRAGMA optimize
+        await _DB.executescript("PRAGMA analysis_limit = 400; ANALYZE;")
+        # stamped last, so an interrupted upgrade simply runs again on the next start
+        await _DB.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    # readers are opened after the schema exists, since mode=ro cannot create the file
+    while len(_READER_CONNS) < DB_READERS:
+        conn = await aiosqlite.connect(f"file:{DB_PATH}?mode=ro", uri=True, cached_statements=DB_STATEMENT_CACHE)
+        conn.row_factory = aiosqlite.Row
+        await conn.executescript(DB_RO_PRAGMAS)
+        _READER_CONNS.append(conn)
+        _READER_POOL.put_nowait(conn)
+
+
+async def _ensure_column(db: aiosqlite.Connection, table: str, column: str, decl: str) -> None:
+    async with db.execute(f"PRAGMA table_info({table})") as cur:
+        existing = {r[1] for r in await cur.fetchall()}
+    if column not in existing:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+async def optimize_db() -> None:
+    """Let SQLite refresh statistics that have drifted (cheap when nothing changed)."""
+    async with _DB_WRITE_LOCK:
+        await _db().execute("PRAGMA optimize")
+
+
+async def vacuum_db(pages: int = DB_VACUUM_PAGES) -> None:
+    """Return up to `pages` free pages to the filesystem (no-op unless auto_vacuum is INCREMENTAL)."""
+    async with _DB_WRITE_LOCK:
+        # the pragma frees one page per step and sqlite3's execute() steps only once;
+        # executescript runs it to completion
+        await _db().executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+
+
+async def checkpoint_db() -> None:
+    """Copy committed WAL frames back into the DB without waiting on readers, so the -wal file stays small."""
+    async with _DB_WRITE_LOCK:
+        await _db().execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+
+async def close_db() -> None:
+    """Close the shared DB connections (called on application shutdown)."""
+    global _DB
+    while not _READER_POOL.empty():
+        _READER_POOL.get_nowait()
+    for conn in _READER_CONNS:
+        await conn.close()
+    _READER_CONNS.clear()
+    if _DB is not None:
+        try:
+            await optimize_db()
+        except Exception:
+            log.exception("PRAGMA optimize on shutdown failed")
+        await _DB.close()
+        _DB = None
+
+
+# execute_fetchall is a single hop to the connection's thread, where execute + fetch +
+# cursor close would be three; fetch_one is only used for key lookups and aggregates
+async def fetch_one(sql: str, params: tuple = ()) -> Optional[aiosqlite.Row]:
+    async with reader() as db:
+        rows = await db.execute_fetchall(sql, params)
+    return rows[0] if rows else None
+
+
+async def fetch_all(sql: str, params: tuple = ()) -> List[aiosqlite.Row]:
+    async with reader() as db:
+        return list(await db.execute_fetchall(sql, params))
+
+
+async def execute(sql: str, params: tuple = ()) -> int:
+    """Run a single write statement and return the cursor's lastrowid."""
+    async with _DB_WRITE_LOCK:
+        async with _db().execute(sql, params) as cur:
+            return cur.lastrowid
+
+
+async def execute_returning(sql: str, params: tuple = ()) -> Optional[aiosqlite.Row]:
+    """Run a single write statement with a RETURNING clause and return its (first) row."""
+    async with _DB_WRITE_LOCK:
+        async with _db().execute(sql, params) as cur:
+            return await cur.fetchone()
+
+
+@asynccontextmanager
+async def transaction():
+    """Run the enclosed writes in one BEGIN IMMEDIATE ... COMMIT (one fsync)."""
+    db = _db()
+    async with _DB_WRITE_LOCK:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            await db.rollback()
+            raise
         await db.commit()
 
 
+# ----- group commit -----
+# Order/payment inserts are queued and committed together by write_batcher, so a
+# burst of submissions costs one BEGIN ... COMMIT instead of one per handler.
+_WRITE_QUEUE: "asyncio.Queue[Tuple[Callable[[aiosqlite.Connection], Awaitable], asyncio.Future]]" = asyncio.Queue()
+_WRITER_TASK: Optional[asyncio.Task] = None
+_STOP_WRITER = object()  # queued by stop_writer: commit everything ahead of it, then exit
+
+
+async def submit_write(op: Callable[[aiosqlite.Connection], Awaitable]):
+    """Queue op(db) for the next group commit and return its result once committed."""
+    if _WRITER_TASK is None:
+        raise RuntimeError("DB writer is not running")
+    fut = asyncio.get_running_loop().create_future()
+    await _WRITE_QUEUE.put((op, fut))
+    return await fut
+
+
+async def _commit_batch(batch) -> None:
+    try:
+        async with transaction() as db:
+            results = [await op(db) for op, _ in batch]
+    except Exception as e:
+        if len(batch) == 1:
+            if not batch[0][1].done():
+                batch[0][1].set_exception(e)
+            return
+        # the batch was rolled back; retry one by one so a bad write only fails its own caller
+        for item in batch:
+            await _commit_batch([item])
+        return
+    for (_, fut), res in zip(batch, results):
+        if not fut.done():
+            fut.set_result(res)
+
+
+async def write_batcher() -> None:
+    stopping = False
+    while not stopping:
+        batch = []
+        item = await _WRITE_QUEUE.get()
+        if item is _STOP_WRITER:
+            stopping = True
+        else:
+            batch.append(item)
+            await asyncio.sleep(WRITE_BATCH_WINDOW)
+        while not _WRITE_QUEUE.empty():
+            item = _WRITE_QUEUE.get_nowait()
+            if item is _STOP_WRITER:
+                stopping = True
+            else:
+                batch.append(item)
+        if not batch:
+            continue
+        try:
+            await _commit_batch(batch)
+        except BaseException as e:
+            # never leave a caller waiting on a future nobody will resolve
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e if isinstance(e, Exception) else RuntimeError("DB writer stopped"))
+            if not isinstance(e, Exception):
+                raise
+            # an unexpected error fails this batch only; the writer keeps serving later submissions
+            log.exception("group commit failed")
+
+
+async def start_writer() -> None:
+    global _WRITER_TASK
+    _WRITER_TASK = asyncio.get_running_loop().create_task(write_batcher())
+
+
+async def stop_writer() -> None:
+    """Commit whatever is still queued or in flight, then stop the writer task."""
+    global _WRITER_TASK
+    if _WRITER_TASK is None:
+        return
+    # clearing _WRITER_TASK first makes later submit_write calls fail fast instead of
+    # queueing behind the sentinel where nothing would ever commit them
+    task, _WRITER_TASK = _WRITER_TASK, None
+    _WRITE_QUEUE.put_nowait(_STOP_WRITER)
+    try:
+        await task
+    except asyncio.CancelledError:
+        if not task.cancelled():
+            raise
+    except Exception:
+        log.exception("DB writer failed while stopping")
+    # if the task was cancelled from outside, it never reached the sentinel: commit the rest here
+    batch = [item for item in (_WRITE_QUEUE.get_nowait() for _ in range(_WRITE_QUEUE.qsize())) if item is not _STOP_WRITER]
+    if batch:
+        await _commit_batch(batch)
+
+
+# ----- shop cache -----
+# Shop rows only change in db_set_shop / db_extend_shop, so lookups are served
+# from a bounded LRU keyed by owner_id (None is cached too, for non-owners).
+# Entries also expire after SHOP_CACHE_TTL as a safety net.
+_MISSING = object()
+# owner_id -> (time.monotonic() deadline, row)
+_SHOP_CACHE: "OrderedDict[int, Tuple[float, Optional[aiosqlite.Row]]]" = OrderedDict()
+# owner_id -> (day the answer holds for, time.monotonic() deadline, is_active)
+_ACTIVE_CACHE: "OrderedDict[int, Tuple[object, float, bool]]" = OrderedDict()
+# page -> (time.monotonic() when rendered, (text, keyboard)) for the admin listing
+_SHOPS_PAGE_CACHE: dict = {}
+# customer user_id -> shop opened via the deep link. Kept out of user_data on purpose:
+# user_data is persisted, and every visitor's selection would grow the pickle forever.
+# The link re-establishes it after a restart; a running /order carries it in OrderCtx.
+_CURRENT_SHOP: "OrderedDict[int, int]" = OrderedDict()
+
+
+def _cache_get(cache: OrderedDict, key):
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        cache.move_to_end(key)
+    return value
+
+
+def _cache_put(cache: OrderedDict, key, value, maxsize: int = SHOP_CACHE_SIZE) -> None:
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > maxsize:
+        cache.popitem(last=False)
+
+
+def _invalidate_shop(owner_id: int) -> None:
+    _SHOP_CACHE.pop(owner_id, None)
+    _ACTIVE_CACHE.pop(owner_id, None)
+    _SHOPS_PAGE_CACHE.clear()
+
+
 async def db_get_shop(owner_id: int) -> Optional[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT owner_id, shop_name, expire_date, created_at FROM shops WHERE owner_id = ?", (owner_id,))
-        row = await cur.fetchone()
-        await cur.close()
-        return row
+    hit = _cache_get(_SHOP_CACHE, owner_id)
+    if hit is not _MISSING and time.monotonic() < hit[0]:
+        return hit[1]
+    row = await fetch_one(_SQL_GET_SHOP, (owner_id,))
+    _cache_put(_SHOP_CACHE, owner_id, (time.monotonic() + SHOP_CACHE_TTL, row))
+    return row
 
 
 async def db_set_shop(owner_id: int, shop_name: str, expire_date: str) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO shops(owner_id, shop_name, expire_date, created_at) VALUES(?,?,?,?)",
-            (owner_id, shop_name, expire_date, datetime.utcnow().strftime("%Y-%m-%d")),
-        )
-        await db.commit()
+    await execute(
+        _SQL_SET_SHOP,
+        (owner_id, shop_name, expire_date),
+    )
+    _invalidate_shop(owner_id)
+
+
+async def db_list_shops_page(page: int) -> List[aiosqlite.Row]:
+    """Shops of a 0-based page; one extra row is fetched to tell whether a next page exists."""
+    return await fetch_all(_SQL_LIST_SHOPS_PAGE, (SHOPS_PAGE_SIZE + 1, page * SHOPS_PAGE_SIZE))
+
+
+async def db_list_shop_owners() -> List[int]:
+    return [r[0] for r in await fetch_all(_SQL_LIST_SHOP_OWNERS)]
 
 
 async def db_extend_shop(owner_id: int, days: int) -> str:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT expire_date FROM shops WHERE owner_id = ?", (owner_id,))
-        row = await cur.fetchone()
-        await cur.close()
-        if row and row[0]:
-            try:
-                cur_exp = datetime.strptime(row[0], "%Y-%m-%d")
-            except Exception:
-                cur_exp = datetime.utcnow()
-        else:
-            cur_exp = datetime.utcnow()
-        new_exp = (cur_exp + timedelta(days=days)).strftime("%Y-%m-%d")
-        await db.execute("UPDATE shops SET expire_date = ? WHERE owner_id = ?", (new_exp, owner_id))
-        await db.commit()
-        return new_exp
+    """Push the shop's expiry out by `days` in one statement; returns the new expiry date."""
+    row = await execute_returning(_SQL_EXTEND_SHOP, (days, owner_id))
+    _invalidate_shop(owner_id)
+    if row is None:  # no shop row: nothing to extend, report what a fresh one would get
+        return (datetime.utcnow().date() + timedelta(days=days)).isoformat()
+    return row[0]
 
 
 async def db_add_product(owner_id: int, name: str, price: int) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT INTO products(owner_id, name, price) VALUES(?,?,?)", (owner_id, name, price))
-        await db.commit()
+    await execute(_SQL_ADD_PRODUCT, (owner_id, name, price))
 
 
 async def db_list_products(owner_id: int) -> List[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT id, name, price FROM products WHERE owner_id = ?", (owner_id,))
-        rows = await cur.fetchall()
-        await cur.close()
-        return rows
+    return await fetch_all(_SQL_LIST_PRODUCTS, (owner_id,))
 
 
 async def db_get_product(pid: int, owner_id: Optional[int] = None) -> Optional[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        if owner_id is not None:
-            cur = await db.execute("SELECT id, name, price FROM products WHERE id = ? AND owner_id = ?", (pid, owner_id))
-        else:
-            cur = await db.execute("SELECT id, name, price FROM products WHERE id = ?", (pid,))
-        row = await cur.fetchone()
-        await cur.close()
-        return row
+    if owner_id is not None:
+        return await fetch_one(_SQL_GET_OWNED_PRODUCT, (pid, owner_id))
+    return await fetch_one(_SQL_GET_PRODUCT, (pid,))
 
 
 async def db_update_product(pid: int, owner_id: int, name: str, price: int) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE products SET name = ?, price = ? WHERE id = ? AND owner_id = ?", (name, price, pid, owner_id))
-        await db.commit()
+    await execute(_SQL_UPDATE_PRODUCT, (name, price, pid, owner_id))
 
 
 async def db_delete_product(pid: int, owner_id: int) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM products WHERE id = ? AND owner_id = ?", (pid, owner_id))
-        await db.commit()
+    await execute(_SQL_DELETE_PRODUCT, (pid, owner_id))
 
 
 async def db_add_link(owner_id: int, title: str, url: str) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT INTO links(owner_id, title, url) VALUES(?,?,?)", (owner_id, title, url))
-        await db.commit()
+    await execute(_SQL_ADD_LINK, (owner_id, title, url))
 
 
 async def db_list_links(owner_id: int) -> List[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT id, title, url FROM links WHERE owner_id = ?", (owner_id,))
-        rows = await cur.fetchall()
-        await cur.close()
-        return rows
+    return await fetch_all(_SQL_LIST_LINKS, (owner_id,))
 
 
 async def db_get_link(lid: int, owner_id: int) -> Optional[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT id, title, url FROM links WHERE id = ? AND owner_id = ?", (lid, owner_id))
-        row = await cur.fetchone()
-        await cur.close()
-        return row
+    return await fetch_one(_SQL_GET_LINK, (lid, owner_id))
 
 
 async def db_update_link(lid: int, owner_id: int, title: str, url: str) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE links SET title = ?, url = ? WHERE id = ? AND owner_id = ?", (title, url, lid, owner_id))
-        await db.commit()
+    await execute(_SQL_UPDATE_LINK, (title, url, lid, owner_id))
 
 
-async def db_create_order(shop_id: int, user_id: int, name: str, phone: str, address: str, items: str, total: int, photo_path: str) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "INSERT INTO orders(shop_id, user_id, name, phone, address, items, total, photo_path, status, created_at) VALUES(?,?,?,?,?,?,?,?,?,?)",
-            (shop_id, user_id, name, phone, address, items, total, photo_path, "Pending", datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")),
-        )
-        await db.commit()
-        oid = cur.lastrowid
-        await cur.close()
-        return oid
+async def db_create_order_and_payment(shop_id: int, user_id: int, name: str, phone: str, address: str, items: str, total: int, photo_path: str, photo_file_id: Optional[str] = None) -> Tuple[int, int]:
+    """Insert an order and its 'order' payment placeholder atomically; returns (oid, pid)."""
+    async def op(db: aiosqlite.Connection) -> Tuple[int, int]:
+        async with db.execute(
+            _SQL_INSERT_ORDER,
+            (shop_id, user_id, name, phone, address, items, total, photo_path, photo_file_id, "Pending"),
+        ) as cur:
+            oid = cur.lastrowid
+        async with db.execute(
+            _SQL_INSERT_PAYMENT,
+            (user_id, "order", oid, photo_path, photo_file_id, "pending"),
+        ) as cur:
+            return oid, cur.lastrowid
+
+    return await submit_write(op)
 
 
 async def db_get_order(oid: int) -> Optional[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT * FROM orders WHERE id = ?", (oid,))
-        row = await cur.fetchone()
-        await cur.close()
-        return row
+    return await fetch_one(_SQL_GET_ORDER, (oid,))
 
 
 async def db_update_order_status(oid: int, status: str) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE orders SET status = ? WHERE id = ?", (status, oid))
-        await db.commit()
+    await execute(_SQL_SET_ORDER_STATUS, (status, oid))
 
 
-async def db_insert_payment(uid: int, kind: str, ref_id: Optional[int], photo_path: str) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "INSERT INTO payments(uid, kind, ref_id, photo_path, status, created_at) VALUES(?,?,?,?,?,?)",
-            (uid, kind, ref_id, photo_path, "pending", datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")),
-        )
-        await db.commit()
-        pid = cur.lastrowid
-        await cur.close()
-        return pid
+async def db_insert_payment(uid: int, kind: str, ref_id: Optional[int], photo_path: str, photo_file_id: Optional[str] = None) -> int:
+    params = (uid, kind, ref_id, photo_path, photo_file_id, "pending")
+
+    async def op(db: aiosqlite.Connection) -> int:
+        async with db.execute(_SQL_INSERT_PAYMENT, params) as cur:
+            return cur.lastrowid
+
+    return await submit_write(op)
 
 
 async def db_get_pending_payments() -> List[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT id, uid, kind, ref_id, photo_path, status, created_at FROM payments WHERE status = 'pending' ORDER BY id ASC")
-        rows = await cur.fetchall()
-        await cur.close()
-        return rows
+    """Pending payments; order payments carry their order's total/name (NULL otherwise)."""
+    return await fetch_all(_SQL_PENDING_PAYMENTS)
 
 
 async def db_update_payment_status(pid: int, status: str) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE payments SET status = ? WHERE id = ?", (status, pid))
-        await db.commit()
+    await execute(_SQL_SET_PAYMENT_STATUS, (status, pid))
+
+
+_STATS_CACHE: Optional[Tuple[float, aiosqlite.Row]] = None  # (time.monotonic() deadline, row)
+
+
+async def db_platform_stats() -> aiosqlite.Row:
+    """Return (shops, orders, pending payments) counts in a single round-trip, cached for STATS_TTL."""
+    global _STATS_CACHE
+    if _STATS_CACHE is not None and time.monotonic() < _STATS_CACHE[0]:
+        return _STATS_CACHE[1]
+    row = await fetch_one(_SQL_PLATFORM_STATS)
+    _STATS_CACHE = (time.monotonic() + STATS_TTL, row)
+    return row
 
 
 async def db_list_orders_by_shop(owner_id: int) -> List[aiosqlite.Row]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT id, user_id, name, phone, address, items, total, status, created_at FROM orders WHERE shop_id = ? ORDER BY id DESC", (owner_id,))
-        rows = await cur.fetchall()
-        await cur.close()
-        return rows
+    return await fetch_all(_SQL_LIST_ORDERS_BY_SHOP, (owner_id,))
 
 
 # ---------------- HELPERS ----------------
-def utcnow_str() -> str:
-    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+# photo filename suffix: seeded from the clock once, then strictly increasing, so two
+# photos from the same user in the same instant can never overwrite each other
+_PHOTO_SEQ = count(time.time_ns())
+
+
+def _write_bytes(path: str, data: bytes) -> None:
+    with open(path, "wb") as fh:
+        fh.write(data)
+
+
+def _read_bytes(path: str) -> Optional[bytes]:
+    """Whole file contents, or None if it is gone (run via asyncio.to_thread)."""
+    try:
+        with open(path, "rb") as fh:
+            return fh.read()
+    except FileNotFoundError:
+        return None
+
+
+async def _archive_photo(photo, filename: str) -> None:
+    try:
+        photo_file = await photo.get_file()
+        data = bytes(await photo_file.download_as_bytearray())
+        await asyncio.to_thread(_write_bytes, filename, data)
+    except Exception:
+        log.exception("archiving photo %s failed", filename)
+
+
+def archive_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, prefix: str) -> Tuple[str, str]:
+    """Start archiving the message's largest photo under PHOTOS_DIR.
+
+    Telegram already holds the upload, so callers forward it by file_id right away;
+    the download and disk write run in the background.
+    Returns (archive path, file_id).
+    """
+    photo = update.message.photo[-1]
+    filename = os.path.join(PHOTOS_DIR, f"{prefix}_{update.effective_user.id}_{next(_PHOTO_SEQ)}.jpg")
+    context.application.create_task(_archive_photo(photo, filename))
+    return filename, photo.file_id
 
 
 async def is_shop_active(owner_id: int) -> bool:
     if owner_id == ADMIN_ID:
         return True
+    today = datetime.utcnow().date()
+    cached = _cache_get(_ACTIVE_CACHE, owner_id)
+    if cached is not _MISSING and cached[0] == today and time.monotonic() < cached[1]:
+        return cached[2]
+    active = False
     shop = await db_get_shop(owner_id)
-    if not shop:
-        return False
-    exp = shop["expire_date"]
-    if not exp:
-        return False
-    try:
-        return datetime.utcnow().date() <= datetime.strptime(exp, "%Y-%m-%d").date()
-    except Exception:
-        return False
+    if shop and shop["expire_date"]:
+        try:
+            active = today <= date.fromisoformat(shop["expire_date"])
+        except Exception:
+            active = False
+    _cache_put(_ACTIVE_CACHE, owner_id, (today, time.monotonic() + SHOP_CACHE_TTL, active))
+    return active
+
+
+def tg_len(text: str) -> int:
+    """Length as Telegram counts it for message limits: UTF-16 code units (emoji count 2)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def tg_clip(text: str, limit: int) -> str:
+    """Cut text to at most `limit` UTF-16 code units without splitting a surrogate pair."""
+    if tg_len(text) <= limit:
+        return text
+    return text.encode("utf-16-le")[: 2 * limit].decode("utf-16-le", errors="ignore")
+
+
+async def reply_lines(message, lines: Iterable[str]) -> None:
+    """Reply with the lines joined by newlines, split at line boundaries into as many
+    messages as needed to stay under MESSAGE_CHUNK UTF-16 units each."""
+    buf: List[str] = []
+    size = 0
+    for line in lines:
+        line = tg_clip(line, MESSAGE_CHUNK)
+        n = tg_len(line)
+        if buf and size + n > MESSAGE_CHUNK:
+            await message.reply_text("\n".join(buf))
+            buf, size = [], 0
+        buf.append(line)
+        size += n + 1
+    if buf:
+        await message.reply_text("\n".join(buf))
 
 
 # ---------------- BOT HANDLERS ----------------
@@ -345,9 +841,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not await is_shop_active(shop_id):
             await update.message.reply_text("❌ ဆိုင်သည် သက်တမ်းကုန်ဆုံးနေပါသည်။")
             return
-        context.user_data["current_shop_id"] = shop_id
         shop = await db_get_shop(shop_id)
         if shop:
+            # only real shops are selectable: orders reference shops(owner_id) and foreign
+            # keys are enforced, so an order for a missing shop could never be stored
+            _cache_put(_CURRENT_SHOP, uid, shop_id, CURRENT_SHOP_SIZE)
             await update.message.reply_text(f"🏪 **{shop['shop_name']}** မှ ကြိုဆိုပါသည်။\nအမှာစာရန် /order သို့ဝင်ပါ။", reply_markup=ReplyKeyboardRemove())
         else:
             await update.message.reply_text("Shop not found.")
@@ -355,8 +853,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # admin panel
     if uid == ADMIN_ID:
-        kb = [["📊 Platform Stats", "📥 Pending Payments"], ["🏬 All Shops", "📤 Broadcast"]]
-        await update.message.reply_text("👑 Admin Panel", reply_markup=ReplyKeyboardMarkup(kb, resize_keyboard=True))
+        await update.message.reply_text("👑 Admin Panel", reply_markup=ADMIN_KB)
         return
 
     # owner panel
@@ -365,13 +862,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not await is_shop_active(uid):
             await update.message.reply_text("❌ Your shop subscription has expired. Please renew with /pay_subscribe.")
             return
-        kb = [["➕ Add Product", "🛒 My Orders"], ["🔗 My Link", "💳 Subscription"]]
-        await update.message.reply_text(f"🏪 Owner Panel: {shop['shop_name']}", reply_markup=ReplyKeyboardMarkup(kb, resize_keyboard=True))
+        await update.message.reply_text(f"🏪 Owner Panel: {shop['shop_name']}", reply_markup=OWNER_KB)
         return
 
     # new user
-    kb = [["📝 Create Shop (/setup_shop MyShopName)", "ℹ️ Help"]]
-    await update.message.reply_text("Welcome to MarketLink Pro!\nTo create a shop: /setup_shop <ShopName>", reply_markup=ReplyKeyboardMarkup(kb, resize_keyboard=True))
+    await update.message.reply_text("Welcome to MarketLink Pro!\nTo create a shop: /setup_shop <ShopName>", reply_markup=NEW_KB)
 
 
 # ----- Shop setup -----
@@ -381,7 +876,7 @@ async def setup_shop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not name:
         await update.message.reply_text("Usage: /setup_shop <Shop Name>")
         return
-    exp = (datetime.utcnow() + timedelta(days=TRIAL_DAYS)).strftime("%Y-%m-%d")
+    exp = (datetime.utcnow().date() + timedelta(days=TRIAL_DAYS)).isoformat()
     await db_set_shop(uid, name, exp)
     await update.message.reply_text(f"✅ Shop created: {name}\nTrial until {exp}\nOpen your panel with /start")
 
@@ -412,10 +907,7 @@ async def cmd_list_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not rows:
         await update.message.reply_text("No products yet. Add with /add_product")
         return
-    text = "📦 Your Products:\n\n"
-    for r in rows:
-        text += f"ID:{r['id']} • {r['name']} • {r['price']} MMK\n"
-    await update.message.reply_text(text)
+    await reply_lines(update.message, ["📦 Your Products:", "", *(f"ID:{r['id']} • {r['name']} • {r['price']} MMK" for r in rows)])
 
 
 # Edit product conversation
@@ -425,10 +917,7 @@ async def edit_product_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not rows:
         await update.message.reply_text("No products to edit.")
         return ConversationHandler.END
-    msg = "Send Product ID to edit:\n\n"
-    for r in rows:
-        msg += f"ID:{r['id']} • {r['name']} • {r['price']} MMK\n"
-    await update.message.reply_text(msg)
+    await reply_lines(update.message, ["Send Product ID to edit:", "", *(f"ID:{r['id']} • {r['name']} • {r['price']} MMK" for r in rows)])
     return EDIT_PROD_ID
 
 
@@ -484,6 +973,10 @@ async def cmd_add_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(context.args) < 2:
         await update.message.reply_text("Usage: /add_link <title> <url>")
         return
+    # links reference shops(owner_id) and foreign keys are enforced: check before inserting
+    if not await db_get_shop(uid):
+        await update.message.reply_text("You are not a shop owner. Create shop with /setup_shop")
+        return
     title = context.args[0]
     url = context.args[1]
     await db_add_link(uid, title, url)
@@ -496,10 +989,7 @@ async def cmd_list_links(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not rows:
         await update.message.reply_text("No links.")
         return
-    txt = "🔗 Your Links:\n\n"
-    for r in rows:
-        txt += f"ID:{r['id']} • {r['title']} • {r['url']}\n"
-    await update.message.reply_text(txt)
+    await reply_lines(update.message, ["🔗 Your Links:", "", *(f"ID:{r['id']} • {r['title']} • {r['url']}" for r in rows)])
 
 
 # Edit link conversation
@@ -509,11 +999,7 @@ async def edit_link_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not rows:
         await update.message.reply_text("No links to edit.")
         return ConversationHandler.END
-    msg = "✏️ Your Links (ID)\n\n"
-    for r in rows:
-        msg += f"ID:{r['id']} • {r['title']} • {r['url']}\n"
-    msg += "\nSend Link ID to edit:"
-    await update.message.reply_text(msg)
+    await reply_lines(update.message, ["✏️ Your Links (ID)", "", *(f"ID:{r['id']} • {r['title']} • {r['url']}" for r in rows), "", "Send Link ID to edit:"])
     return EDIT_LINK_ID
 
 
@@ -551,30 +1037,30 @@ async def edit_link_get_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ----- Order Flow (customer must send photo) -----
 async def order_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # Ensure user has a current_shop_id (via deep link /start <shop_id> or explicit /shop command)
-    if "current_shop_id" not in context.user_data:
+    # the customer must have opened a shop first (deep link /start <shop_id>)
+    shop_id = _cache_get(_CURRENT_SHOP, update.effective_user.id)
+    if shop_id is _MISSING:
         await update.message.reply_text("Please open the shop first using the bot start link: /start <shop_id>\nExample: /start 123456 (or use owner's link).")
         return ConversationHandler.END
-    context.user_data["cart"] = []  # optional textual items
-    context.user_data["total"] = 0
+    context.user_data["_order"] = OrderCtx(shop_id=shop_id)
     await update.message.reply_text("Your name:", reply_markup=ReplyKeyboardRemove())
     return ORDER_NAME
 
 
 async def order_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["cust_name"] = update.message.text.strip()
+    context.user_data["_order"].name = update.message.text.strip()
     await update.message.reply_text("Phone:")
     return ORDER_PHONE
 
 
 async def order_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["cust_phone"] = update.message.text.strip()
+    context.user_data["_order"].phone = update.message.text.strip()
     await update.message.reply_text("Address:")
     return ORDER_ADDRESS
 
 
 async def order_address(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data["cust_address"] = update.message.text.strip()
+    context.user_data["_order"].address = update.message.text.strip()
     await update.message.reply_text("Now, send a photo of the item you want (required). You can also type item description with the photo.")
     return ORDER_PHOTO
 
@@ -585,32 +1071,32 @@ async def order_photo_receive(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Please send a photo of the item (required).")
         return ORDER_PHOTO
 
-    # save largest photo
-    photo_file = await update.message.photo[-1].get_file()
-    filename = os.path.join(PHOTOS_DIR, f"order_{update.effective_user.id}_{int(datetime.utcnow().timestamp())}.jpg")
-    await photo_file.download_to_drive(filename)
+    # fetch largest photo (archived to disk in the background)
+    filename, file_id = archive_photo(update, context, "order")
 
+    o: OrderCtx = context.user_data["_order"]
     # optional: the user can include items text in the message caption or previous messages
-    items_text = ""
     if update.message.caption:
         items_text = update.message.caption.strip()
     else:
-        items_text = ", ".join(context.user_data.get("cart", [])) or ""
+        items_text = ", ".join(o.cart)
 
-    sid = context.user_data["current_shop_id"]
+    sid = o.shop_id
     uid = update.effective_user.id
-    name = context.user_data.get("cust_name", "")
-    phone = context.user_data.get("cust_phone", "")
-    address = context.user_data.get("cust_address", "")
+    name, phone, address = o.name, o.phone, o.address
 
     # total is optional (0 if not provided)
-    total = context.user_data.get("total", 0)
-
-    # create order record
-    oid = await db_create_order(sid, uid, name, phone, address, items_text, total, filename)
+    total = o.total
 
-    # insert a payment record placeholder (kind = 'order', photo is the customer's item photo)
-    pid = await db_insert_payment(uid, "order", oid, filename)
+    # create order record + payment placeholder (kind = 'order', photo is the customer's item photo)
+    try:
+        oid, pid = await db_create_order_and_payment(sid, uid, name, phone, address, items_text, total, filename, file_id)
+    except Exception:
+        # end the conversation instead of leaving the customer stuck in ORDER_PHOTO
+        log.exception("creating order failed")
+        context.user_data.pop("_order", None)
+        await update.message.reply_text("❌ Could not place the order. Please open the shop link again and retry.")
+        return ConversationHandler.END
 
     # notify shop owner (if shop exists) else admin
     shop = await db_get_shop(sid)
@@ -624,15 +1110,13 @@ async def order_photo_receive(update: Update, context: ContextTypes.DEFAULT_TYPE
     ]
     target = owner_id or ADMIN_ID
     try:
-        with open(filename, "rb") as fh:
-            await context.bot.send_photo(chat_id=target, photo=fh, caption=f"New order #{oid}\nFrom: {uid}\nName: {name}\nPhone: {phone}\nTotal: {total} MMK", reply_markup=InlineKeyboardMarkup(kb))
+        await context.bot.send_photo(chat_id=target, photo=file_id, caption=f"New order #{oid}\nFrom: {uid}\nName: {name}\nPhone: {phone}\nTotal: {total} MMK", reply_markup=InlineKeyboardMarkup(kb))
     except Exception:
         log.exception("Failed to notify owner/admin about new order")
 
     await update.message.reply_text("✅ Your order has been submitted and is pending confirmation from the shop. We'll notify you when it's processed.")
     # cleanup conversation state
-    for k in ("cart", "total", "cust_name", "cust_phone", "cust_address"):
-        context.user_data.pop(k, None)
+    context.user_data.pop("_order", None)
     return ConversationHandler.END
 
 
@@ -646,10 +1130,8 @@ async def pay_subscription_receive(update: Update, context: ContextTypes.DEFAULT
     if not update.message.photo:
         await update.message.reply_text("Please send a photo (payment screenshot).")
         return PAYMENT_WAIT
-    photo_file = await update.message.photo[-1].get_file()
-    filename = os.path.join(PHOTOS_DIR, f"pay_sub_{update.effective_user.id}_{int(datetime.utcnow().timestamp())}.jpg")
-    await photo_file.download_to_drive(filename)
-    pid = await db_insert_payment(update.effective_user.id, "subscription", None, filename)
+    filename, file_id = archive_photo(update, context, "pay_sub")
+    pid = await db_insert_payment(update.effective_user.id, "subscription", None, filename, file_id)
     kb = [
         [
             InlineKeyboardButton("Approve ✅", callback_data=f"sub_ok_{pid}_{update.effective_user.id}"),
@@ -657,8 +1139,7 @@ async def pay_subscription_receive(update: Update, context: ContextTypes.DEFAULT
         ]
     ]
     try:
-        with open(filename, "rb") as fh:
-            await context.bot.send_photo(chat_id=ADMIN_ID, photo=fh, caption=f"Subscription payment (uid={update.effective_user.id})", reply_markup=InlineKeyboardMarkup(kb))
+        await context.bot.send_photo(chat_id=ADMIN_ID, photo=file_id, caption=f"Subscription payment (uid={update.effective_user.id})", reply_markup=InlineKeyboardMarkup(kb))
     except Exception:
         log.exception("Failed to notify admin about subscription payment")
     await update.message.reply_text("✅ Payment submitted. Waiting admin approval.")
@@ -666,74 +1147,85 @@ async def pay_subscription_receive(update: Update, context: ContextTypes.DEFAULT
 
 
 # ----- Callback handler (admin/owner actions) -----
+async def _subscription_callback(q, context: ContextTypes.DEFAULT_TYPE, caller: Optional[int], approve: bool, pid: int, uid: int):
+    # only admin
+    if caller != ADMIN_ID:
+        await q.answer("Not authorized", show_alert=True)
+        return
+    if approve:
+        new_exp = await db_extend_shop(uid, SUBSCRIPTION_EXTEND_DAYS)
+        await db_update_payment_status(pid, "approved")
+        try:
+            await context.bot.send_message(uid, f"✅ Subscription approved. New expiry: {new_exp}")
+        except Exception:
+            log.exception("notify user subscription approved failed")
+        await q.edit_message_caption(caption=f"Subscription processed. Approved -> UID {uid}")
+    else:
+        await db_update_payment_status(pid, "rejected")
+        try:
+            await context.bot.send_message(uid, f"❌ Subscription payment rejected by admin.")
+        except Exception:
+            log.exception("notify user subscription rejected failed")
+        await q.edit_message_caption(caption=f"Subscription processed. Rejected -> UID {uid}")
+
+
+async def _order_callback(q, context: ContextTypes.DEFAULT_TYPE, caller: Optional[int], approve: bool, oid: int, pid: int):
+    order = await db_get_order(oid)
+    if not order:
+        await q.edit_message_text("Order not found.")
+        return
+    user_id = order["user_id"]
+    # orders.shop_id is the owner's user id (shops are keyed by owner_id), so no shop lookup
+    owner_id = order["shop_id"]
+    # only owner or admin can approve
+    if caller != ADMIN_ID and caller != owner_id:
+        await q.answer("Not authorized", show_alert=True)
+        return
+    if approve:
+        await db_update_order_status(oid, "Confirmed")
+        await db_update_payment_status(pid, "approved")
+        try:
+            await context.bot.send_message(user_id, f"🔔 Your order #{oid} has been confirmed by the shop.")
+        except Exception:
+            log.exception("notify user order confirmed failed")
+        await q.edit_message_caption(caption=f"Order #{oid} - Confirmed")
+    else:
+        await db_update_order_status(oid, "Rejected")
+        await db_update_payment_status(pid, "rejected")
+        try:
+            await context.bot.send_message(user_id, f"🔔 Your order #{oid} was rejected by the shop. Contact the shop for details.")
+        except Exception:
+            log.exception("notify user order rejected failed")
+        await q.edit_message_caption(caption=f"Order #{oid} - Rejected")
+
+
+# callback_data is "<prefix>_<id>_<id>"; prefix -> (handler, approve)
+#   sub_ok_<pid>_<uid> / sub_no_<pid>_<uid>, order_conf_<oid>_<pid> / order_rej_<oid>_<pid>
+_CALLBACK_HANDLERS = {
+    "sub_ok": (_subscription_callback, True),
+    "sub_no": (_subscription_callback, False),
+    "order_conf": (_order_callback, True),
+    "order_rej": (_order_callback, False),
+}
+# registered as the CallbackQueryHandler pattern, so other buttons never reach admin_callback
+ADMIN_CALLBACK_PATTERN = re.compile(rf"^({'|'.join(_CALLBACK_HANDLERS)})_\d+_\d+$")
+
+
 async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     data = q.data or ""
     caller = q.from_user.id if q.from_user else None
 
-    try:
-        # subscription approve/reject: sub_ok_<pid>_<uid> or sub_no_<pid>_<uid>
-        if data.startswith("sub_ok_") or data.startswith("sub_no_"):
-            # only admin
-            if caller != ADMIN_ID:
-                await q.answer("Not authorized", show_alert=True)
-                return
-            parts = data.split("_")
-            action = parts[1]
-            pid = int(parts[2])
-            uid = int(parts[3])
-            if action == "ok":
-                new_exp = await db_extend_shop(uid, SUBSCRIPTION_EXTEND_DAYS)
-                await db_update_payment_status(pid, "approved")
-                try:
-                    await context.bot.send_message(uid, f"✅ Subscription approved. New expiry: {new_exp}")
-                except Exception:
-                    log.exception("notify user subscription approved failed")
-                await q.edit_message_caption(caption=f"Subscription processed. Approved -> UID {uid}")
-            else:
-                await db_update_payment_status(pid, "rejected")
-                try:
-                    await context.bot.send_message(uid, f"❌ Subscription payment rejected by admin.")
-                except Exception:
-                    log.exception("notify user subscription rejected failed")
-                await q.edit_message_caption(caption=f"Subscription processed. Rejected -> UID {uid}")
-
-        # order confirmation: order_conf_<oid>_<pid> or order_rej_<oid>_<pid>
-        elif data.startswith("order_conf_") or data.startswith("order_rej_"):
-            parts = data.split("_")
-            action = parts[1]
-            oid = int(parts[2])
-            pid = int(parts[3])
-            order = await db_get_order(oid)
-            if not order:
-                await q.edit_message_text("Order not found.")
-                return
-            user_id = order["user_id"]
-            shop_id = order["shop_id"]
-            shop = await db_get_shop(shop_id)
-            owner_id = shop["owner_id"] if shop else None
-            # only owner or admin can approve
-            if caller != ADMIN_ID and caller != owner_id:
-                await q.answer("Not authorized", show_alert=True)
-                return
-            if action == "conf":
-                await db_update_order_status(oid, "Confirmed")
-                await db_update_payment_status(pid, "approved")
-                try:
-                    await context.bot.send_message(user_id, f"🔔 Your order #{oid} has been confirmed by the shop.")
-                except Exception:
-                    log.exception("notify user order confirmed failed")
-                await q.edit_message_caption(caption=f"Order #{oid} - Confirmed")
-            else:
-                await db_update_order_status(oid, "Rejected")
-                await db_update_payment_status(pid, "rejected")
-                try:
-                    await context.bot.send_message(user_id, f"🔔 Your order #{oid} was rejected by the shop. Contact the shop for details.")
-                except Exception:
-                    log.exception("notify user order rejected failed")
-                await q.edit_message_caption(caption=f"Order #{oid} - Rejected")
+    # one rsplit yields the prefix and both ids; no per-branch startswith/split
+    parts = data.rsplit("_", 2)
+    route = _CALLBACK_HANDLERS.get(parts[0]) if len(parts) == 3 else None
+    if route is None:
+        return
+    handler, approve = route
 
+    try:
+        await handler(q, context, caller, approve, int(parts[1]), int(parts[2]))
     except Exception:
         log.exception("admin_callback error")
         try:
@@ -751,154 +1243,256 @@ async def cmd_pending_payments(update: Update, context: ContextTypes.DEFAULT_TYP
     if not rows:
         await update.message.reply_text("No pending payments.")
         return
-    for p in rows:
-        pid = p["id"]
-        uid = p["uid"]
-        kind = p["kind"]
-        ref_id = p["ref_id"]
-        path = p["photo_path"]
-        status = p["status"]
-        created = p["created_at"]
-        text = f"PID:{pid} UID:{uid} Kind:{kind} Ref:{ref_id} Status:{status} Created:{created}"
-        try:
-            if path and os.path.exists(path):
-                with open(path, "rb") as fh:
-                    kb = []
-                    if kind == "subscription":
-                        kb = [[InlineKeyboardButton("Approve", callback_data=f"sub_ok_{pid}_{uid}"), InlineKeyboardButton("Reject", callback_data=f"sub_no_{pid}_{uid}")]]
-                    elif kind == "order":
-                        kb = [[InlineKeyboardButton("Approve Order", callback_data=f"order_conf_{ref_id}_{pid}"), InlineKeyboardButton("Reject Order", callback_data=f"order_rej_{ref_id}_{pid}")]]
-                    await context.bot.send_photo(chat_id=ADMIN_ID, photo=fh, caption=text, reply_markup=InlineKeyboardMarkup(kb))
-            else:
-                await update.message.reply_text(text + "\n(photo missing)")
-        except Exception:
-            log.exception("cmd_pending_payments send failed")
-            await update.message.reply_text(text + "\n(send failed)")
+    # sent together; the application's AIORateLimiter paces them at SEND_RATE/s.
+    # _send_pending reports its own failures, so gather only needs to not stop early
+    await asyncio.gather(*(_send_pending(update, context, p) for p in rows), return_exceptions=True)
+
+
+async def _send_pending(update: Update, context: ContextTypes.DEFAULT_TYPE, p: aiosqlite.Row) -> None:
+    pid = p["id"]
+    uid = p["uid"]
+    kind = p["kind"]
+    ref_id = p["ref_id"]
+    path = p["photo_path"]
+    status = p["status"]
+    created = p["created_at"]
+    text = f"PID:{pid} UID:{uid} Kind:{kind} Ref:{ref_id} Status:{status} Created:{created}"
+    if kind == "order" and p["total"] is not None:
+        text += f"\nOrder: {p['name']} • {p['total']} MMK"
+    try:
+        # Telegram still has the upload: resend by file_id; only older rows without
+        # one fall back to the archived file (read in a worker thread)
+        photo = p["photo_file_id"]
+        if photo is None and path:
+            photo = await asyncio.to_thread(_read_bytes, path)
+        if photo is not None:
+            kb = []
+            if kind == "subscription":
+                kb = [[InlineKeyboardButton("Approve", callback_data=f"sub_ok_{pid}_{uid}"), InlineKeyboardButton("Reject", callback_data=f"sub_no_{pid}_{uid}")]]
+            elif kind == "order":
+                kb = [[InlineKeyboardButton("Approve Order", callback_data=f"order_conf_{ref_id}_{pid}"), InlineKeyboardButton("Reject Order", callback_data=f"order_rej_{ref_id}_{pid}")]]
+            await context.bot.send_photo(chat_id=ADMIN_ID, photo=photo, caption=text, reply_markup=InlineKeyboardMarkup(kb))
+        else:
+            await update.message.reply_text(text + "\n(photo missing)")
+    except Exception:
+        log.exception("cmd_pending_payments send failed")
+        await update.message.reply_text(text + "\n(send failed)")
 
 
 # ----- Export orders to Excel (owner) -----
-async def cmd_export_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+EXPORT_COLUMNS = ["order_id", "user_id", "name", "phone", "address", "items", "total", "status", "created_at"]
+EXPORT_SEM = asyncio.Semaphore(2)  # workbook builds allowed to run in worker threads at once
+
+
+def _write_xlsx(workbook_cls, rows: List[tuple], fh) -> None:
+    """Write rows into a write-only workbook saved to fh (run via asyncio.to_thread)."""
+    wb = workbook_cls(write_only=True)
+    ws = wb.create_sheet("orders")
+    ws.append(EXPORT_COLUMNS)
+    for r in rows:
+        ws.append(r)
+    wb.save(fh)
+
+
+async def _export_orders_csv(update: Update, uid: int) -> None:
+    """CSV export: stdlib only, rows streamed from the cursor into an in-memory buffer."""
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(EXPORT_COLUMNS)
+    n_rows = 0
+    async with reader() as db, db.execute(_SQL_LIST_ORDERS_BY_SHOP, (uid,)) as cur:
+        async for r in cur:
+            w.writerow(tuple(r))
+            n_rows += 1
+    if not n_rows:
+        await update.message.reply_text("No orders.")
+        return
     try:
-        import pandas as pd
+        # utf-8-sig so Excel opens non-Latin names correctly
+        data = io.BytesIO(buf.getvalue().encode("utf-8-sig"))
+        await update.message.reply_document(document=data, filename=f"orders_{uid}_{time.time_ns()}.csv")
     except Exception:
-        await update.message.reply_text("Pandas not installed. Install pandas + openpyxl to export.")
-        return
+        log.exception("export orders failed")
+        await update.message.reply_text("Failed to export orders.")
+
+
+async def cmd_export_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    rows = await db_list_orders_by_shop(uid)
+    # "/export_orders csv" asks for CSV; it is also the fallback when openpyxl is missing
+    if context.args and context.args[0].lower() == "csv":
+        await _export_orders_csv(update, uid)
+        return
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        await _export_orders_csv(update, uid)
+        return
+    rows = await fetch_all(_SQL_LIST_ORDERS_BY_SHOP, (uid,))
     if not rows:
         await update.message.reply_text("No orders.")
         return
-    df = []
-    for r in rows:
-        df.append(
-            {
-                "order_id": r["id"],
-                "user_id": r["user_id"],
-                "name": r["name"],
-                "phone": r["phone"],
-                "address": r["address"],
-                "items": r["items"],
-                "total": r["total"],
-                "status": r["status"],
-                "created_at": r["created_at"],
-            }
-        )
-    df = __import__("pandas").DataFrame(df)
-    path = f"orders_{uid}_{int(datetime.utcnow().timestamp())}.xlsx"
+    filename = f"orders_{uid}_{time.time_ns()}.xlsx"
     try:
-        df.to_excel(path, index=False)
-        with open(path, "rb") as fh:
-            await update.message.reply_document(document=fh, filename=os.path.basename(path))
+        # the zipped workbook is small, so it is built in memory rather than in a temp file.
+        # Building it is CPU work: keep it off the loop, and cap how many run at once so
+        # simultaneous exports can't pile up threads
+        buf = io.BytesIO()
+        async with EXPORT_SEM:
+            await asyncio.to_thread(_write_xlsx, Workbook, [tuple(r) for r in rows], buf)
+        buf.seek(0)
+        await update.message.reply_document(document=buf, filename=filename)
     except Exception:
         log.exception("export orders failed")
         await update.message.reply_text("Failed to export orders.")
-    finally:
-        try:
-            os.remove(path)
-        except Exception:
-            pass
 
 
 # ----- Utility: show shop link -----
 async def cmd_my_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
+    # Application.initialize() already ran get_me() once and cached the bot user,
+    # so only fall back to a network round-trip if that cache is somehow empty
     try:
-        bot_username = (await context.bot.get_me()).username
+        bot_username = context.bot.username
     except Exception:
-        bot_username = None
+        try:
+            bot_username = (await context.bot.get_me()).username
+        except Exception:
+            bot_username = None
     if not bot_username:
         await update.message.reply_text("Bot username not available.")
         return
     await update.message.reply_text(f"https://t.me/{bot_username}?start={uid}")
 
 
-# ----- Menu message handler ----- (keyboard shortcuts)
-async def text_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    t = update.message.text.strip()
+# ----- Menu buttons ----- (keyboard shortcuts, each routed by its own filter in main())
+async def reject_expired_owner(update: Update) -> bool:
+    """Tell an owner whose subscription lapsed to renew; True if the update was handled."""
     uid = update.effective_user.id
-
-    # block expired owner
-    shop = await db_get_shop(uid)
-    if shop and not await is_shop_active(uid):
+    if await db_get_shop(uid) and not await is_shop_active(uid):
         await update.message.reply_text("❌ Your subscription expired. Please renew with /pay_subscribe.")
+        return True
+    return False
+
+
+async def menu_add_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await reject_expired_owner(update):
         return
+    await update.message.reply_text("Use /add_product <name> <price> or /list_products to manage.")
 
-    # Owner options
-    if t == "➕ Add Product" or t == "/add_product":
-        await update.message.reply_text("Use /add_product <name> <price> or /list_products to manage.")
+
+async def menu_my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await reject_expired_owner(update):
         return
-    if t == "🛒 My Orders":
-        rows = await db_list_orders_by_shop(uid)
-        if not rows:
-            await update.message.reply_text("No orders.")
-            return
-        msg = "📦 Your Orders:\n\n"
-        for r in rows:
-            msg += f"#{r['id']} | {r['name']} | {r['total']} MMK | {r['status']}\n"
-        await update.message.reply_text(msg)
+    rows = await db_list_orders_by_shop(update.effective_user.id)
+    if not rows:
+        await update.message.reply_text("No orders.")
+        return
+    await reply_lines(update.message, ["📦 Your Orders:", "", *(f"#{r['id']} | {r['name']} | {r['total']} MMK | {r['status']}" for r in rows)])
+
+
+async def menu_my_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await reject_expired_owner(update):
+        return
+    await cmd_my_link(update, context)
+
+
+async def menu_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await reject_expired_owner(update):
+        return
+    await update.message.reply_text(f"Subscription is {SUBSCRIPTION_FEE} MMK per {SUBSCRIPTION_EXTEND_DAYS} days.\nUse /pay_subscribe to pay.", reply_markup=ReplyKeyboardRemove())
+
+
+# admin-only buttons: main() registers these behind filters.User(ADMIN_ID)
+async def menu_platform_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    shops, orders, pend = await db_platform_stats()
+    await update.message.reply_text(f"Shops:{shops}\nOrders:{orders}\nPending payments:{pend}")
+
+
+async def render_shops_page(page: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    hit = _SHOPS_PAGE_CACHE.get(page)
+    if hit and time.monotonic() - hit[0] < SHOPS_PAGE_TTL:
+        return hit[1]
+    res = await _render_shops_page(page)
+    _SHOPS_PAGE_CACHE[page] = (time.monotonic(), res)
+    return res
+
+
+async def _render_shops_page(page: int) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    rows = await db_list_shops_page(page)
+    if not rows and page == 0:
+        return "No shops yet.", None
+    has_next = len(rows) > SHOPS_PAGE_SIZE
+    rows = rows[:SHOPS_PAGE_SIZE]
+    # the page is one editable message (Prev/Next edit it in place), so it cannot be split:
+    # clipped names keep SHOPS_PAGE_SIZE lines well under Telegram's 4096-unit limit
+    txt = f"All Shops (page {page + 1}):\n" + "\n".join(
+        f"ID:{r['owner_id']} • {tg_clip(r['shop_name'] or '', SHOP_NAME_LISTED)} • Exp:{r['expire_date']}" for r in rows
+    )
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"shops:page:{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"shops:page:{page + 1}"))
+    return txt, InlineKeyboardMarkup([nav]) if nav else None
+
+
+async def menu_all_shops(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    txt, kb = await render_shops_page(0)
+    await update.message.reply_text(txt, reply_markup=kb)
+
+
+async def menu_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("Send /broadcast <message> to message every shop owner.")
+
+
+async def cmd_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("Only admin.")
         return
-    if t == "🔗 My Link":
-        await cmd_my_link(update, context)
+    # keep the admin's line breaks: take everything after the command entity, so
+    # "/broadcast\nHello world" keeps its first line too
+    msg = update.message
+    cmd = msg.entities[0] if msg.entities else None
+    text = msg.text[cmd.offset + cmd.length:].strip() if cmd else ""
+    if not text:
+        await msg.reply_text("Usage: /broadcast <message>")
         return
-    if t == "💳 Subscription":
-        await update.message.reply_text(f"Subscription is {SUBSCRIPTION_FEE} MMK per {SUBSCRIPTION_EXTEND_DAYS} days.\nUse /pay_subscribe to pay.", reply_markup=ReplyKeyboardRemove())
+    # an over-long text would fail for every owner
+    if tg_len(text) > MessageLimit.MAX_TEXT_LENGTH:
+        await msg.reply_text(f"Message too long: keep it under {MessageLimit.MAX_TEXT_LENGTH} characters.")
         return
+    owners = set(await db_list_shop_owners())
+    # fired together; the application's AIORateLimiter paces them at SEND_RATE/s
+    results = await asyncio.gather(*(context.bot.send_message(o, text) for o in owners), return_exceptions=True)
+    failed = sum(isinstance(r, Exception) for r in results)
+    await update.message.reply_text(f"Broadcast sent to {len(owners) - failed}/{len(owners)} shops.")
 
-    # Admin menu
-    if uid == ADMIN_ID:
-        if t == "📊 Platform Stats":
-            async with aiosqlite.connect(DB_PATH) as con:
-                cur = await con.execute("SELECT COUNT(*) FROM shops")
-                shops = (await cur.fetchone())[0]
-                await cur.close()
-                cur = await con.execute("SELECT COUNT(*) FROM orders")
-                orders = (await cur.fetchone())[0]
-                await cur.close()
-                cur = await con.execute("SELECT COUNT(*) FROM payments WHERE status='pending'")
-                pend = (await cur.fetchone())[0]
-                await cur.close()
-            await update.message.reply_text(f"Shops:{shops}\nOrders:{orders}\nPending payments:{pend}")
-            return
-        if t == "📥 Pending Payments":
-            await cmd_pending_payments(update, context)
-            return
-        if t == "🏬 All Shops":
-            async with aiosqlite.connect(DB_PATH) as con:
-                con.row_factory = aiosqlite.Row
-                cur = await con.execute("SELECT owner_id, shop_name, expire_date FROM shops")
-                rows = await cur.fetchall()
-                await cur.close()
-            txt = "All Shops:\n"
-            for r in rows:
-                txt += f"ID:{r['owner_id']} • {r['shop_name']} • Exp:{r['expire_date']}\n"
-            await update.message.reply_text(txt)
-            return
 
-    # Fallback
-    if t == "ℹ️ Help" or t == "/help":
-        await update.message.reply_text("/setup_shop, /add_product, /list_products, /edit_product, /add_link, /edit_link, /order (open shop link first) /pay_subscribe")
+# shops:page:<n> (Prev/Next buttons under the All Shops listing)
+async def shops_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    if not q.from_user or q.from_user.id != ADMIN_ID:
+        await q.answer("Not authorized", show_alert=True)
         return
+    await q.answer()
+    try:
+        page = max(0, int(q.data.rsplit(":", 1)[1]))
+        txt, kb = await render_shops_page(page)
+        await q.edit_message_text(txt, reply_markup=kb)
+    except Exception:
+        log.exception("shops_page_callback error")
+
 
+async def menu_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await reject_expired_owner(update):
+        return
+    await update.message.reply_text("/setup_shop, /add_product, /list_products, /edit_product, /add_link, /edit_link, /order (open shop link first) /pay_subscribe")
+
+
+# Fallback for any other text outside a conversation
+async def text_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await reject_expired_owner(update):
+        return
     await update.message.reply_text("Command not recognized. Use /help")
 
 
@@ -909,57 +1503,88 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+async def conversation_timeout(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Run by PTB when a conversation sat idle for CONVERSATION_TIMEOUT: drop its drafts."""
+    for k in ("_order", "edit_product_id", "edit_product_name", "edit_link_id", "edit_link_title"):
+        context.user_data.pop(k, None)
+    return ConversationHandler.END
+
+
 # ---------------- Background cleanup ----------------
-async def cleanup_old_photos_task(app: Application, interval_hours: int = 24):
-    """Background task that periodically removes photo files older than retention days.
+def _purge_photos(paths: Iterable[str]) -> Tuple[int, set]:
+    """Unlink the given photo files (run via asyncio.to_thread); returns (removed, failed paths).
+
+    Paths are grouped by directory and each directory is listed once with os.scandir,
+    so files that are already gone cost no syscall of their own.
+    """
+    by_dir = defaultdict(list)
+    for p in paths:
+        by_dir[os.path.dirname(p) or "."].append(p)
+    removed, failed = 0, set()
+    for d, dir_paths in by_dir.items():
+        try:
+            with os.scandir(d) as it:
+                present = {e.name for e in it}
+        except FileNotFoundError:
+            continue
+        for p in dir_paths:
+            if os.path.basename(p) not in present:
+                continue
+            try:
+                os.unlink(p)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError:
+                log.exception("cleanup photo error for %s", p)
+                failed.add(p)
+    return removed, failed
+
+
+async def _flush_persistence_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    # with on_flush=True the pickle is written only here (and on shutdown): one dump per interval
+    await context.application.persistence.flush()
+
+
+async def _optimize_db_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        await optimize_db()
+    except Exception:
+        log.exception("PRAGMA optimize failed")
+    try:
+        await checkpoint_db()
+    except Exception:
+        log.exception("WAL checkpoint failed")
+
+
+async def cleanup_old_photos(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job that removes photo files older than retention days.
     When a file is removed, any order/payment referencing it will have photo_path set to NULL
     to avoid broken references.
     """
-    log.info("Photo cleanup task started (retention %d days)", PHOTO_RETENTION_DAYS)
-    while True:
-        try:
-            cutoff = datetime.utcnow() - timedelta(days=PHOTO_RETENTION_DAYS)
-            removed = 0
-            async with aiosqlite.connect(DB_PATH) as db:
-                # find payment photo files older than cutoff
-                db.row_factory = aiosqlite.Row
-                cur = await db.execute("SELECT id, photo_path FROM payments WHERE photo_path IS NOT NULL")
-                payment_rows = await cur.fetchall()
-                await cur.close()
-                for p in payment_rows:
-                    path = p["photo_path"]
-                    try:
-                        if path and os.path.exists(path):
-                            mtime = datetime.utcfromtimestamp(os.path.getmtime(path))
-                            if mtime < cutoff:
-                                os.remove(path)
-                                await db.execute("UPDATE payments SET photo_path = NULL WHERE id = ?", (p["id"],))
-                                removed += 1
-                    except Exception:
-                        log.exception("cleanup payment photo error for %s", path)
-                # orders
-                cur = await db.execute("SELECT id, photo_path FROM orders WHERE photo_path IS NOT NULL")
-                order_rows = await cur.fetchall()
-                await cur.close()
-                for o in order_rows:
-                    path = o["photo_path"]
-                    try:
-                        if path and os.path.exists(path):
-                            mtime = datetime.utcfromtimestamp(os.path.getmtime(path))
-                            if mtime < cutoff:
-                                os.remove(path)
-                                await db.execute("UPDATE orders SET photo_path = NULL WHERE id = ?", (o["id"],))
-                                removed += 1
-                    except Exception:
-                        log.exception("cleanup order photo error for %s", path)
-                if removed:
-                    await db.commit()
-            if removed:
-                log.info("Cleanup removed %d old photo files", removed)
-        except Exception:
-            log.exception("cleanup task failed")
-        # sleep
-        await asyncio.sleep(interval_hours * 3600)
+    # SQLite picks the expired rows; nothing is parsed or stat'ed for the rest
+    cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - PHOTO_RETENTION_DAYS * 86400))
+    expired = [
+        (clear_sql, await fetch_all(select_sql, (cutoff,)))
+        for select_sql, clear_sql in ((_SQL_PAYMENT_PHOTOS, _SQL_CLEAR_PAYMENT_PHOTO), (_SQL_ORDER_PHOTOS, _SQL_CLEAR_ORDER_PHOTO))
+    ]
+    # an order and its 'order' payment share one file, hence the set
+    paths = sorted({r["photo_path"] for _, rows in expired for r in rows})
+    removed, failed = 0, set()
+    # bounded chunks keep each worker call short and let other to_thread users in between
+    for i in range(0, len(paths), PHOTO_PURGE_CHUNK):
+        n, chunk_failed = await asyncio.to_thread(_purge_photos, paths[i:i + PHOTO_PURGE_CHUNK])
+        removed += n
+        failed |= chunk_failed
+    # rows are cleared even if their file was already gone, so they are not selected
+    # again next run; only files that failed to unlink keep their reference (retry)
+    if any(rows for _, rows in expired):
+        async with transaction() as db:
+            for clear_sql, rows in expired:
+                await db.executemany(clear_sql, [(r["id"],) for r in rows if r["photo_path"] not in failed])
+    if removed:
+        log.info("Cleanup removed %d old photo files", removed)
+    await vacuum_db()
 
 
 # ---------------- MAIN ----------------
@@ -969,49 +1594,122 @@ def main():
     if ADMIN_ID == 0:
         log.warning("ADMIN_ID is 0 or not set. Set ADMIN_ID in .env for admin functions.")
 
-    # build app
-    app = Application.builder().token(BOT_TOKEN).build()
+    # open the shared DB connection and schedule the background jobs inside the polling loop,
+    # so the connection is bound to the same event loop that serves updates
+    async def _post_init(application: Application) -> None:
+        await init_db()
+        await start_writer()
+        # exceptions from jobs are reported by PTB's error logging, so the job needs no catch-all
+        # one instance at a time; a run delayed by a busy loop still happens (within the
+        # grace time) and a backlog of missed runs collapses into one
+        job_kwargs = {"max_instances": 1, "coalesce": True, "misfire_grace_time": 3600}
+        application.job_queue.run_repeating(cleanup_old_photos, interval=PHOTO_CLEANUP_INTERVAL, first=10, job_kwargs=job_kwargs)
+        application.job_queue.run_repeating(
+            _optimize_db_job, interval=DB_OPTIMIZE_INTERVAL, first=DB_OPTIMIZE_INTERVAL, job_kwargs=job_kwargs
+        )
+        application.job_queue.run_repeating(
+            _flush_persistence_job, interval=PERSISTENCE_FLUSH_INTERVAL, first=PERSISTENCE_FLUSH_INTERVAL, job_kwargs=job_kwargs
+        )
+        # older versions kept the deep-link shop in persisted user_data; shed it once
+        for user_id, data in list(application.user_data.items()):
+            if data.pop("current_shop_id", None) is None:
+                continue
+            if data:
+                application.mark_data_for_update_persistence(user_ids=user_id)
+            else:
+                application.drop_user_data(user_id)
+
+    async def _post_shutdown(application: Application) -> None:
+        await stop_writer()
+        await close_db()
+
+    # conversation states and their user_data drafts survive a restart, so users
+    # mid-flow resume where they were instead of falling through to the menu handler.
+    # on_flush: PTB would otherwise re-pickle the whole file, on the event loop, once per
+    # changed user and conversation; _flush_persistence_job writes it once per interval
+    persistence = PicklePersistence(
+        filepath=CONV_STATE_PATH,
+        store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+        on_flush=True,
+    )
 
-    # register handlers (conversations)
+    # build app; block=False lets PTB dispatch handlers concurrently, so one user's
+    # DB write or Telegram upload no longer holds up everyone else's updates
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .defaults(Defaults(block=False))
+        .persistence(persistence)
+        # paces outgoing calls under Telegram's flood limits and retries a RetryAfter
+        # (429) up to SEND_RETRIES times, so fan-outs like /broadcast and /pending_payments
+        # don't count flood-limited sends as failures
+        .rate_limiter(AIORateLimiter(overall_max_rate=SEND_RATE, overall_time_period=1, max_retries=SEND_RETRIES))
+        # larger HTTPX pools so concurrent handlers don't queue on "pool occupied"
+        .connection_pool_size(256)
+        .pool_timeout(20)
+        .get_updates_connection_pool_size(16)
+        .get_updates_pool_timeout(30)
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
+
+    # register handlers (conversations); idle ones expire after CONVERSATION_TIMEOUT
+    timeout_state = {ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_timeout)]}
     order_conv = ConversationHandler(
         entry_points=[CommandHandler("order", order_start)],
         states={
-            ORDER_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, order_name)],
-            ORDER_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, order_phone)],
-            ORDER_ADDRESS: [MessageHandler(filters.TEXT & ~filters.COMMAND, order_address)],
+            ORDER_NAME: [MessageHandler(TEXT_NONCMD, order_name)],
+            ORDER_PHONE: [MessageHandler(TEXT_NONCMD, order_phone)],
+            ORDER_ADDRESS: [MessageHandler(TEXT_NONCMD, order_address)],
             ORDER_PHOTO: [MessageHandler(filters.PHOTO, order_photo_receive)],
+            **timeout_state,
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         per_user=True,
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        name="order",
+        persistent=True,
     )
 
     edit_prod_conv = ConversationHandler(
         entry_points=[CommandHandler("edit_product", edit_product_start)],
         states={
-            EDIT_PROD_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_product_get_id)],
-            EDIT_PROD_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_product_name)],
-            EDIT_PROD_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_product_price)],
+            EDIT_PROD_ID: [MessageHandler(TEXT_NONCMD, edit_product_get_id)],
+            EDIT_PROD_NAME: [MessageHandler(TEXT_NONCMD, edit_product_name)],
+            EDIT_PROD_PRICE: [MessageHandler(TEXT_NONCMD, edit_product_price)],
+            **timeout_state,
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         per_user=True,
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        name="edit_product",
+        persistent=True,
     )
 
     edit_link_conv = ConversationHandler(
         entry_points=[CommandHandler("edit_link", edit_link_start)],
         states={
-            EDIT_LINK_ID: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_link_get_id)],
-            EDIT_LINK_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_link_get_title)],
-            EDIT_LINK_URL: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_link_get_url)],
+            EDIT_LINK_ID: [MessageHandler(TEXT_NONCMD, edit_link_get_id)],
+            EDIT_LINK_TITLE: [MessageHandler(TEXT_NONCMD, edit_link_get_title)],
+            EDIT_LINK_URL: [MessageHandler(TEXT_NONCMD, edit_link_get_url)],
+            **timeout_state,
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         per_user=True,
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        name="edit_link",
+        persistent=True,
     )
 
     pay_conv = ConversationHandler(
         entry_points=[CommandHandler("pay_subscribe", pay_subscription_start)],
-        states={PAYMENT_WAIT: [MessageHandler(filters.PHOTO, pay_subscription_receive)]},
+        states={PAYMENT_WAIT: [MessageHandler(filters.PHOTO, pay_subscription_receive)], **timeout_state},
         fallbacks=[CommandHandler("cancel", cancel)],
         per_user=True,
+        conversation_timeout=CONVERSATION_TIMEOUT,
+        name="pay_subscribe",
+        persistent=True,
     )
 
     # register command handlers
@@ -1029,23 +1727,36 @@ def main():
     app.add_handler(CommandHandler("pending_payments", cmd_pending_payments))
     app.add_handler(CommandHandler("export_orders", cmd_export_orders))
     app.add_handler(CommandHandler("my_link", cmd_my_link))
-    app.add_handler(CallbackQueryHandler(admin_callback))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_menu_handler))
+    app.add_handler(CommandHandler("broadcast", cmd_broadcast))
+    app.add_handler(CommandHandler("help", menu_help))
+    app.add_handler(CallbackQueryHandler(shops_page_callback, pattern=r"^shops:page:\d+$"))
+    app.add_handler(CallbackQueryHandler(admin_callback, pattern=ADMIN_CALLBACK_PATTERN))
+    # menu buttons: PTB matches the exact label, so only the relevant callback runs
+    admin_only = filters.User(user_id=ADMIN_ID)
+    app.add_handler(MessageHandler(filters.Text([MENU_ADD_PRODUCT]), menu_add_product))
+    app.add_handler(MessageHandler(filters.Text([MENU_MY_ORDERS]), menu_my_orders))
+    app.add_handler(MessageHandler(filters.Text([MENU_MY_LINK]), menu_my_link))
+    app.add_handler(MessageHandler(filters.Text([MENU_SUBSCRIPTION]), menu_subscription))
+    app.add_handler(MessageHandler(admin_only & filters.Text([MENU_PLATFORM_STATS]), menu_platform_stats))
+    app.add_handler(MessageHandler(admin_only & filters.Text([MENU_PENDING]), cmd_pending_payments))
+    app.add_handler(MessageHandler(admin_only & filters.Text([MENU_ALL_SHOPS]), menu_all_shops))
+    app.add_handler(MessageHandler(admin_only & filters.Text([MENU_BROADCAST]), menu_broadcast))
+    app.add_handler(MessageHandler(filters.Text([MENU_HELP]), menu_help))
+    app.add_handler(MessageHandler(TEXT_NONCMD, text_menu_handler))
     app.add_handler(CommandHandler("cancel", cancel))
 
-    # run DB init and start cleanup background task
-    async def _startup():
-        await init_db()
-        # start cleanup background task (runs forever)
-        app.create_task(cleanup_old_photos_task(app, interval_hours=24))
-
-    app.post_init = lambda _: None  # placeholder
-    # run startup tasks then start polling
     log.info("Initializing DB and starting bot...")
-    # run init_db and then start the bot
-    asyncio.run(_startup())  # ensure DB created before run_polling (safe)
-
-    app.run_polling(stop_signals=None)
+    if WEBHOOK_URL:
+        # no getUpdates long-poll loop; Telegram pushes each update to us
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=BOT_TOKEN,
+            webhook_url=f"{WEBHOOK_URL}/{BOT_TOKEN}",
+            stop_signals=None,
+        )
+    else:
+        app.run_polling(stop_signals=None)
 
 
 if __name__ == "__main__":